@@ -1,6 +1,8 @@
 from django.contrib import admin
+from django.db.models.expressions import RawSQL
 
 from .models import Group, Post, Comment, Follow, Like
+from .search import matching_ids_sql, search_enabled
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -9,6 +11,13 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ("pub_date",)
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not search_enabled():
+            return super().get_search_results(request, queryset,
+                                              search_term)
+        return queryset.filter(
+            pk__in=RawSQL(*matching_ids_sql(search_term))), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ("pk", "title", "slug", "description")
@@ -0,0 +1,183 @@
+import copy
+import hashlib
+import math
+import random
+import time
+from collections import namedtuple
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+
+from .personal import fill_parts
+from .thumbnails import prefetch_card_thumbnails
+
+
+CacheEntry = namedtuple("CacheEntry", ("value", "expires", "delta"))
+
+
+def generation_key(scope):
+    return f"generation:{scope}"
+
+
+def new_generation():
+    # Time based, so a generation lost from the cache never comes back
+    # with a value some already cached page was stored under.
+    return int(time.time() * 1000)
+
+
+def get_generations(scopes):
+    keys = [generation_key(scope) for scope in scopes]
+    generations = cache.get_many(keys)
+    missing = {key: new_generation() for key in keys
+               if key not in generations}
+    if missing:
+        cache.set_many(missing, None)
+        generations.update(missing)
+    return [generations[key] for key in keys]
+
+
+def bump_generations(scopes):
+    for scope in scopes:
+        key = generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_generation(), None)
+
+
+def lock_key(key):
+    return f"lock:{key}"
+
+
+def is_fresh(entry, now=None):
+    """Whether ``entry`` is served as is.
+
+    Entries are refreshed early with a probability that grows as they near
+    expiry, scaled by how long they took to build, so one request rebuilds
+    a hot key before it expires instead of all of them after.
+    """
+    if entry.expires is None:
+        return True
+    now = time.time() if now is None else now
+    beta = settings.CACHE_EARLY_REFRESH_BETA
+    return now - entry.delta * beta * math.log(random.random() or 1e-12) < (
+        entry.expires)
+
+
+def store_entry(key, value, timeout, delta=0, stale_key=None):
+    expires = None if timeout is None else time.time() + timeout
+    entry = CacheEntry(value, expires, delta)
+    entries = {key: entry}
+    if stale_key is not None:
+        entries[stale_key] = entry
+    cache.set_many(entries, timeout)
+    return entry
+
+
+def get_or_build(key, build, timeout, stale_key=None, cacheable=None):
+    """Return the value cached under ``key``, building it on a miss.
+
+    Only the request holding the lock on ``key`` builds it; the others
+    serve the last value stored under ``stale_key`` meanwhile, or wait up
+    to ``CACHE_LOCK_WAIT`` seconds for the new one when there is none.
+    Values ``cacheable`` rejects are returned without being stored.
+    """
+    entry = cache.get(key)
+    if entry is not None and is_fresh(entry):
+        return entry.value
+    stale = entry
+    if stale is None and stale_key is not None:
+        stale = cache.get(stale_key)
+    if not cache.add(lock_key(key), 1, settings.CACHE_LOCK_TIMEOUT):
+        if stale is not None:
+            return stale.value
+        deadline = time.time() + settings.CACHE_LOCK_WAIT
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry.value
+    try:
+        started = time.time()
+        value = build()
+        if cacheable is None or cacheable(value):
+            store_entry(key, value, timeout, time.time() - started,
+                        stale_key)
+    finally:
+        cache.delete(lock_key(key))
+    return value
+
+
+def card_cache_key(post):
+    # pub_date guards against ids reused after rows are rolled back.
+    return f"{card_stale_key(post)}:{post.version}"
+
+
+def card_stale_key(post):
+    return f"post_card:{post.id}:{post.pub_date.timestamp()}"
+
+
+def prefetch_post_cards(posts):
+    """Attach cached card HTML to ``posts`` with one multi-get; the
+    ``post_card`` tag renders and caches the cards that are missing or
+    due for an early refresh, with their thumbnails prefetched in one
+    batch."""
+    posts_by_key = {card_cache_key(post): post for post in posts}
+    now = time.time()
+    for key, entry in cache.get_many(posts_by_key).items():
+        if is_fresh(entry, now):
+            posts_by_key.pop(key).card_html = entry.value
+    prefetch_card_thumbnails(posts_by_key.values())
+
+
+def page_cache_key(request, kind):
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f"page:{kind}:{url}"
+
+
+def cache_page_per_generation(*scopes):
+    """Cache a GET view until one of its ``scopes`` changes.
+
+    Scopes are formatted with the view kwargs, e.g. ``"group:{slug}"``.
+    Their generations are part of the cache key, so a model write that
+    bumps a scope makes its pages miss at once instead of after a TTL.
+    While one request rebuilds a page the others get its last version.
+
+    Requests without a session cookie share one anonymous copy of a page
+    and are served without loading a session. Requests with one share a
+    shell in which the ``{% personal %}`` parts are filled in per viewer.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            shell = settings.SESSION_COOKIE_NAME in request.COOKIES
+            names = [scope.format(**kwargs) for scope in scopes]
+            generations = ".".join(
+                str(generation) for generation in get_generations(names))
+            stale_key = page_cache_key(request,
+                                       "shell" if shell else "anonymous")
+
+            def build():
+                request.page_shell = shell
+                response = view(request, *args, **kwargs)
+                patch_vary_headers(response, ("Cookie",))
+                return response
+
+            def cacheable(response):
+                return (response.status_code == 200
+                        and not response.streaming and not response.cookies)
+
+            response = get_or_build(f"{stale_key}.{generations}", build,
+                                    settings.PAGE_CACHE_TIMEOUT,
+                                    stale_key=stale_key, cacheable=cacheable)
+            if shell and not response.streaming:
+                shell_response, response = response, copy.copy(response)
+                response.content = fill_parts(
+                    request, shell_response.content.decode(response.charset))
+            return response
+        return wrapper
+    return decorator
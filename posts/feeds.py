@@ -0,0 +1,58 @@
+import heapq
+
+from .models import FeedItem, Follow, Like, Post
+from .paginator import keyset_range
+
+
+class FollowFeed:
+    """Posts of the authors ``user`` follows.
+
+    Regular authors are pushed into the materialized ``FeedItem`` rows on
+    write. Authors above ``FEED_FANOUT_FOLLOWER_LIMIT`` followers are pulled
+    from ``Post`` at read time, and both ranges are merged into one page.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._pulled_authors = None
+
+    @property
+    def pulled_authors(self):
+        if self._pulled_authors is None:
+            self._pulled_authors = list(
+                Follow.objects.get_pulled_authors(self.user))
+        return self._pulled_authors
+
+    def keyset_keys(self, date, pk, reverse, limit):
+        pushed = FeedItem.objects.filter(user=self.user).values_list(
+            "pub_date", "post_id")
+        rows = [list(keyset_range(pushed, "pub_date", "post_id",
+                                  date, pk, reverse)[:limit])]
+        if self.pulled_authors:
+            pulled = Post.objects.filter(
+                author__in=self.pulled_authors).values_list("pub_date", "id")
+            rows.append(list(keyset_range(pulled, "pub_date", "id",
+                                          date, pk, reverse)[:limit]))
+        keys = []
+        for key in heapq.merge(*rows, reverse=not reverse):
+            if key not in keys:
+                keys.append(key)
+            if len(keys) == limit:
+                break
+        return keys
+
+    def keyset_slice(self, date, pk, reverse, limit):
+        ids = [post_id for _, post_id in
+               self.keyset_keys(date, pk, reverse, limit)]
+        posts = Post.objects.get_feed().in_bulk(ids)
+        return [posts[post_id] for post_id in ids if post_id in posts]
+
+
+def mark_liked_posts(posts, user):
+    """Set ``is_liked`` on every post with one query for the whole page."""
+    liked = set()
+    if user.is_authenticated and posts:
+        liked = Like.objects.get_liked_post_ids(
+            user, [post.id for post in posts])
+    for post in posts:
+        post.is_liked = post.id in liked
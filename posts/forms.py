@@ -1,8 +1,84 @@
+from io import BytesIO
+
+from PIL import Image, ImageOps, ImageSequence
 from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
 from django.forms import ModelForm
 
 from .models import Post, Comment
 
+IMAGE_FORMATS = ("JPEG", "PNG", "GIF", "WEBP")
+
+
+def check_image_upload(upload):
+    """Reject ``upload`` by its size and header, before decoding it.
+
+    ``ImageField`` has only parsed the header by now: Pillow decodes
+    pixels on first access.
+    """
+    limit = settings.IMAGE_UPLOAD_MAX_BYTES
+    if upload.size > limit:
+        raise ValidationError("The file is larger than %(limit)s MB.",
+                              code="file_too_big",
+                              params={"limit": limit // 2 ** 20})
+    image = upload.image
+    if image.format not in IMAGE_FORMATS:
+        raise ValidationError("Upload a JPEG, PNG, GIF or WebP image.",
+                              code="invalid_image")
+    frames = getattr(image, "n_frames", 1)
+    if frames > settings.IMAGE_MAX_FRAMES:
+        raise ValidationError(
+            "The animation has more than %(limit)s frames.",
+            code="too_many_frames",
+            params={"limit": settings.IMAGE_MAX_FRAMES})
+    if image.width * image.height * frames > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            "The image is larger than %(limit)s megapixels.",
+            code="too_many_pixels",
+            params={"limit": settings.IMAGE_MAX_PIXELS // 10 ** 6})
+
+
+def resize_animation(image):
+    """Return the first frame of animated ``image`` and the options saving
+    it with the others, every frame resized like a still image."""
+    side = settings.IMAGE_MAX_SIDE
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(image):
+        durations.append(frame.info.get("duration", 100))
+        frame = frame.convert("RGBA")
+        frame.thumbnail((side, side), Image.LANCZOS)
+        frames.append(frame)
+    return frames[0], {"save_all": True, "append_images": frames[1:],
+                       "duration": durations,
+                       "loop": image.info.get("loop", 0)}
+
+
+def reencode_image(upload):
+    """Return ``upload`` re-encoded with at most ``IMAGE_MAX_SIDE`` pixels
+    a side and without its metadata, animations with all their frames."""
+    upload.seek(0)
+    image = Image.open(upload)
+    image_format = image.format
+    if getattr(image, "is_animated", False):
+        image, options = resize_animation(image)
+    else:
+        side = settings.IMAGE_MAX_SIDE
+        # JPEGs are drafted at a reduced scale, so they are never decoded
+        # at full size.
+        image.thumbnail((side, side), Image.LANCZOS)
+        image = ImageOps.exif_transpose(image)
+        options = {}
+        if image_format == "JPEG":
+            options = {"quality": 90, "optimize": True}
+            if image.mode not in ("RGB", "L", "CMYK"):
+                image = image.convert("RGB")
+    output = BytesIO()
+    image.save(output, image_format, **options)
+    return SimpleUploadedFile(upload.name, output.getvalue(),
+                              content_type=Image.MIME[image_format])
+
 
 class PostForm(ModelForm):
     class Meta:
@@ -11,6 +87,18 @@ class PostForm(ModelForm):
         labels = {"text": "Текст записи", "group": "Название группы",
                   "image": "Картинка", }
 
+    def clean_image(self):
+        image = self.cleaned_data["image"]
+        if not isinstance(image, UploadedFile):
+            return image
+        check_image_upload(image)
+        try:
+            return reencode_image(image)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            raise ValidationError(
+                forms.ImageField.default_error_messages["invalid_image"],
+                code="invalid_image")
+
 
 class CommentForm(ModelForm):
     text = forms.CharField(required=True, widget=forms.Textarea)
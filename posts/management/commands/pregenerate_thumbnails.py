@@ -0,0 +1,25 @@
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import get_pool, pregenerate_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Render the configured thumbnails of every post image"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Size of the process pool")
+
+    def handle(self, *args, **options):
+        names = set(Post.objects.exclude(image="").exclude(
+            image=None).values_list("image", flat=True))
+        if options["workers"]:
+            get_pool(options["workers"])
+        futures = pregenerate_thumbnails(sorted(names))
+        for future in as_completed(futures):
+            future.result()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered thumbnails of {len(names)} images"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = "Recount the denormalized comment and like counters of posts"
+
+    def handle(self, *args, **options):
+        updated = Post.objects.rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(f"Recounted {updated} posts"))
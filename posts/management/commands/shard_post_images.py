@@ -0,0 +1,53 @@
+from django.core.exceptions import SuspiciousOperation
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import Post, StoredImage
+from posts.storage import content_name, is_sharded
+from posts.thumbnails import delete_image
+
+
+class Command(BaseCommand):
+    help = ("Move post images into the hash-sharded layout, rewriting "
+            "Post.image in batches so the site can stay up")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500,
+                            help="Images moved per transaction")
+
+    def handle(self, *args, **options):
+        field = Post._meta.get_field("image")
+        names = Post.objects.exclude(image="").exclude(image=None).order_by(
+            "image").values_list("image", flat=True).distinct()
+        last, moved, skipped = "", 0, 0
+        while True:
+            batch = list(names.filter(image__gt=last)[:options["batch_size"]])
+            if not batch:
+                break
+            last = batch[-1]
+            renames = {}
+            for name in batch:
+                if is_sharded(name):
+                    continue
+                try:
+                    with field.storage.open(name) as image:
+                        new_name = field.generate_filename(
+                            None, content_name(image))
+                        renames[name] = field.storage.save(new_name, image)
+                except (OSError, SuspiciousOperation):
+                    skipped += 1
+            self.rewrite(renames, field.storage)
+            moved += len(renames)
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} images, skipped {skipped} unreadable"))
+
+    def rewrite(self, renames, storage):
+        # The old files stay until the posts point at the new ones, so
+        # readers never see a missing image.
+        with transaction.atomic():
+            for name, new_name in renames.items():
+                count = Post.objects.filter(image=name).update(image=new_name)
+                StoredImage.objects.filter(name=name).delete()
+                StoredImage.objects.add_reference(new_name, count)
+        for name in renames:
+            delete_image(name, storage, thumbnails=False)
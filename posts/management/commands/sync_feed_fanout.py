@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import FeedItem, ProfileStats
+
+
+class Command(BaseCommand):
+    help = ("Drop the feed rows of authors pulled at read time and push "
+            "those back under FEED_FANOUT_RESUME_LIMIT followers again")
+
+    def handle(self, *args, **options):
+        dropped = FeedItem.objects.drop_pulled()
+        pushed = 0
+        for author_id in ProfileStats.objects.get_pushable().iterator():
+            FeedItem.objects.push(author_id)
+            pushed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Dropped {dropped} feed rows, pushed {pushed} authors"))
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.20 on 2026-10-18 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_like'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-pub_date', '-id'], name='post_keyset_idx'),
+        ),
+    ]
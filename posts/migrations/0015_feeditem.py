@@ -0,0 +1,50 @@
+# Generated by Django 2.2.20 on 2026-10-18 18:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_feeds(apps, schema_editor):
+    Follow = apps.get_model("posts", "Follow")
+    Post = apps.get_model("posts", "Post")
+    FeedItem = apps.get_model("posts", "FeedItem")
+    for follow in Follow.objects.iterator():
+        posts = Post.objects.filter(author_id=follow.author_id)
+        FeedItem.objects.bulk_create(
+            [FeedItem(user_id=follow.user_id, post_id=post_id,
+                      pub_date=pub_date)
+             for post_id, pub_date in posts.values_list("id", "pub_date")],
+            batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0014_post_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='date_published')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_items', to='posts.Post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_items', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-pub_date',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='feed_item_keyset_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='feeditem',
+            unique_together={('user', 'post')},
+        ),
+        migrations.RunPython(backfill_feeds, migrations.RunPython.noop),
+    ]
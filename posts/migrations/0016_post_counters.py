@@ -0,0 +1,39 @@
+# Generated by Django 2.2.20 on 2026-10-18 18:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Post = apps.get_model("posts", "Post")
+
+    def count(model_name):
+        model = apps.get_model("posts", model_name)
+        return Coalesce(Subquery(
+            model.objects.filter(post=OuterRef("pk")).order_by().values(
+                "post").annotate(total=Count("pk")).values("total")), 0)
+
+    Post.objects.update(comment_count=count("Comment"),
+                        like_count=count("Like"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_feeditem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='comment_count'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='like_count'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
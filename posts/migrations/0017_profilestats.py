@@ -0,0 +1,43 @@
+# Generated by Django 2.2.20 on 2026-10-18 18:38
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_stats(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    ProfileStats = apps.get_model("posts", "ProfileStats")
+    users = User.objects.annotate(
+        followers=Count("following", distinct=True),
+        followings=Count("follower", distinct=True),
+        posts=Count("author_posts", distinct=True))
+    ProfileStats.objects.bulk_create(
+        [ProfileStats(user=user, followers_count=user.followers,
+                      following_count=user.followings,
+                      posts_count=user.posts)
+         for user in users.iterator()],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0016_post_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('followers_count', models.PositiveIntegerField(default=0, verbose_name='followers_count')),
+                ('following_count', models.PositiveIntegerField(default=0, verbose_name='following_count')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='posts_count')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
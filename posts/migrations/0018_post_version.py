@@ -0,0 +1,18 @@
+# Generated by Django 2.2.20 on 2026-10-18 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_profilestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='version'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.20 on 2026-10-18 19:02
+
+from django.db import migrations, models
+from django.db.models import Count
+import posts.storage
+
+
+def count_references(apps, schema_editor):
+    Post = apps.get_model("posts", "Post")
+    StoredImage = apps.get_model("posts", "StoredImage")
+    images = Post.objects.exclude(image="").exclude(image=None).values(
+        "image").annotate(references=Count("id")).order_by()
+    StoredImage.objects.bulk_create(
+        [StoredImage(name=image["image"], references=image["references"])
+         for image in images.iterator()],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='name')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='references')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/'),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
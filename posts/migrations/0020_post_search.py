@@ -0,0 +1,33 @@
+# Generated by Django 2.2.20 on 2026-10-18 19:06
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE posts_post_search USING fts5(text, "
+        "group_title, author, tokenize='unicode61 remove_diacritics 2')")
+    schema_editor.execute(
+        "INSERT INTO posts_post_search (rowid, text, group_title, author) "
+        "SELECT post.id, post.text, COALESCE(grp.title, ''), user.username "
+        "FROM posts_post post "
+        "JOIN auth_user user ON user.id = post.author_id "
+        "LEFT JOIN posts_group grp ON grp.id = post.group_id")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS posts_post_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_storedimage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
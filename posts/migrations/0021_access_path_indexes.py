@@ -0,0 +1,69 @@
+# Generated by Django 2.2.20 on 2026-10-18 19:07
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicates(model, fields):
+    """Keep the first row of every ``fields`` pair of ``model``; returns
+    the pairs that had duplicates."""
+    pairs = model.objects.values(*fields).annotate(
+        first=Min("id"), rows=Count("id")).filter(rows__gt=1).order_by()
+    duplicated = []
+    for pair in pairs.iterator():
+        first = pair.pop("first")
+        pair.pop("rows")
+        model.objects.filter(**pair).exclude(id=first).delete()
+        duplicated.append(pair)
+    return duplicated
+
+
+def deduplicate_likes_and_follows(apps, schema_editor):
+    Post = apps.get_model("posts", "Post")
+    Like = apps.get_model("posts", "Like")
+    Follow = apps.get_model("posts", "Follow")
+    ProfileStats = apps.get_model("posts", "ProfileStats")
+    for pair in delete_duplicates(Like, ("user", "post")):
+        Post.objects.filter(pk=pair["post"]).update(
+            like_count=Like.objects.filter(post=pair["post"]).count())
+    for pair in delete_duplicates(Follow, ("user", "author")):
+        ProfileStats.objects.filter(user=pair["author"]).update(
+            followers_count=Follow.objects.filter(
+                author=pair["author"]).count())
+        ProfileStats.objects.filter(user=pair["user"]).update(
+            following_count=Follow.objects.filter(
+                user=pair["user"]).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0020_post_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_likes_and_follows,
+                             migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='follow',
+            unique_together={('user', 'author')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='like',
+            unique_together={('user', 'post')},
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', '-created', '-id'], name='comment_post_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='post_author_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-pub_date', '-id'], name='post_group_keyset_idx'),
+        ),
+    ]
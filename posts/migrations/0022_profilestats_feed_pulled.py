@@ -0,0 +1,27 @@
+# Generated by Django 2.2.20 on 2026-10-18 19:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def pull_popular_authors(apps, schema_editor):
+    ProfileStats = apps.get_model("posts", "ProfileStats")
+    ProfileStats.objects.filter(
+        followers_count__gt=settings.FEED_FANOUT_FOLLOWER_LIMIT).update(
+        feed_pulled=True)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profilestats',
+            name='feed_pulled',
+            field=models.BooleanField(default=False, verbose_name='feed_pulled'),
+        ),
+        migrations.RunPython(pull_popular_authors,
+                             migrations.RunPython.noop),
+    ]
@@ -1,5 +1,12 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
@@ -12,14 +19,44 @@ class Group(models.Model):
     def __str__(self):
         return self.title
 
+    def get_cache_scopes(self):
+        """Scopes of the pages showing the title of this group."""
+        authors = User.objects.filter(author_posts__group=self).values_list(
+            "username", flat=True).distinct()
+        return {"index", f"group:{self.slug}"} | {
+            f"profile:{username}" for username in authors}
+
 
 class PostManager(models.Manager):
     def get_followed_authors(self, user, author):
         return self.get_queryset().get(user=user, author=author)
 
+    def get_feed(self):
+        return self.get_queryset().select_related("author", "group")
+
     def get_following_posts(self, user):
         return self.get_queryset().filter(author__following__user=user)
 
+    def add_to_counters(self, post_id, **deltas):
+        return self.get_queryset().filter(pk=post_id).update(
+            **{field: F(field) + delta for field, delta in deltas.items()})
+
+    def bump_versions(self, **lookups):
+        """Renew the cached cards of the posts matching ``lookups``."""
+        return self.get_queryset().filter(**lookups).update(
+            version=F("version") + 1)
+
+    def rebuild_counters(self):
+        def count(model):
+            return Coalesce(Subquery(
+                model.objects.filter(post=OuterRef("pk")).order_by().values(
+                    "post").annotate(total=Count("pk")).values("total")), 0)
+
+        # The cards show the counters, so they are rendered again.
+        return self.get_queryset().update(comment_count=count(Comment),
+                                          like_count=count(Like),
+                                          version=F("version") + 1)
+
 
 class Post(models.Model):
     text = models.TextField("post_text")
@@ -29,15 +66,54 @@ class Post(models.Model):
     group = models.ForeignKey(Group, on_delete=models.SET_NULL,
                               related_name="group_posts", blank=True,
                               null=True)
-    image = models.ImageField(upload_to="posts/", blank=True, null=True)
+    image = models.ImageField(upload_to="posts/", blank=True, null=True,
+                              storage=ContentAddressedStorage())
+    comment_count = models.PositiveIntegerField("comment_count", default=0,
+                                                editable=False)
+    like_count = models.PositiveIntegerField("like_count", default=0,
+                                             editable=False)
+    version = models.PositiveIntegerField("version", default=0,
+                                          editable=False)
     objects = PostManager()
 
+    # Changed only by atomic UPDATEs, never written from instance state.
+    atomic_fields = ("comment_count", "like_count", "version")
+
     class Meta:
         ordering = ("-pub_date",)
+        indexes = (
+            models.Index(fields=("-pub_date", "-id"), name="post_keyset_idx"),
+            models.Index(fields=("author", "-pub_date", "-id"),
+                         name="post_author_keyset_idx"),
+            models.Index(fields=("group", "-pub_date", "-id"),
+                         name="post_group_keyset_idx"),
+        )
 
     def __str__(self):
         return f"{self.author} {self.text[:20]}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            update_fields = kwargs.get("update_fields")
+            if update_fields is None:
+                update_fields = [field.name
+                                 for field in self._meta.concrete_fields
+                                 if not field.primary_key]
+            kwargs["update_fields"] = [name for name in update_fields
+                                       if name not in self.atomic_fields]
+        super().save(*args, **kwargs)
+
+    def get_cache_scopes(self):
+        scopes = {"index", f"profile:{self.author.username}"}
+        group_ids = {self.group_id,
+                     getattr(self, "_loaded_group_id", None)} - {None}
+        if group_ids == {self.group_id} and Post.group.is_cached(self):
+            scopes.add(f"group:{self.group.slug}")
+        elif group_ids:
+            scopes.update(f"group:{slug}" for slug in Group.objects.filter(
+                pk__in=group_ids).values_list("slug", flat=True))
+        return scopes
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE,
@@ -49,12 +125,80 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ("-created",)
+        indexes = (
+            models.Index(fields=("post", "-created", "-id"),
+                         name="comment_post_keyset_idx"),
+        )
+
+
+class UniquePairManager(models.Manager):
+    """Writes of rows unique per pair of users or of user and post, each in
+    one statement that a concurrent duplicate cannot break.
+
+    They bypass ``save()`` and ``delete()``, so the model signals are sent
+    by hand, and only when a row was actually added or removed.
+    """
+
+    def insert_ignore(self, **values):
+        """INSERT a row of ``values`` unless it clashes with a unique
+        constraint; ``True`` if it was inserted."""
+        connection = connections[self.db]
+        ops = connection.ops
+        fields = [self.model._meta.get_field(name) for name in values]
+        sql = "%s %s (%s) VALUES (%s) %s" % (
+            ops.insert_statement(ignore_conflicts=True),
+            ops.quote_name(self.model._meta.db_table),
+            ", ".join(ops.quote_name(field.column) for field in fields),
+            ", ".join(["%s"] * len(fields)),
+            ops.ignore_conflicts_suffix_sql(ignore_conflicts=True))
+        params = [field.get_db_prep_save(values[field.name], connection)
+                  for field in fields]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount == 1
+
+    def add_pair(self, **pair):
+        """Add the row of ``pair``; ``True`` if it was not there yet."""
+        instance = self.model(created=timezone.now(), **pair)
+        with transaction.atomic(using=self.db):
+            added = self.insert_ignore(
+                created=instance.created,
+                **{name: value.pk for name, value in pair.items()})
+            if added:
+                post_save.send(sender=self.model, instance=instance,
+                               created=True, update_fields=None, raw=False,
+                               using=self.db)
+        return added
 
+    def remove_pair(self, **pair):
+        """Remove the row of ``pair``; ``True`` if it was there."""
+        with transaction.atomic(using=self.db):
+            removed = self.get_queryset().filter(**pair)._raw_delete(self.db)
+            if removed:
+                post_delete.send(sender=self.model,
+                                 instance=self.model(**pair), using=self.db)
+        return bool(removed)
+
+
+class FollowManager(UniquePairManager):
+    def follow(self, user, author):
+        return self.add_pair(user=user, author=author)
+
+    def unfollow(self, user, author):
+        return self.remove_pair(user=user, author=author)
 
-class FollowManager(models.Manager):
     def get_follow(self, author, user):
         return self.get_queryset().filter(author=author, user=user)
 
+    def is_pulled_author(self, author):
+        return ProfileStats.objects.filter(user=author,
+                                           feed_pulled=True).exists()
+
+    def get_pulled_authors(self, user):
+        return self.get_queryset().filter(
+            user=user, author__stats__feed_pulled=True).values_list(
+            "author_id", flat=True)
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
@@ -65,10 +209,25 @@ class Follow(models.Model):
                                    auto_now_add=True, db_index=True)
     objects = FollowManager()
 
+    class Meta:
+        unique_together = ("user", "author")
+
     def __str__(self):
         return f"follower - {self.user} following - {self.author} date - {self.created}"
 
 
+class LikeManager(UniquePairManager):
+    def like(self, user, post):
+        return self.add_pair(user=user, post=post)
+
+    def unlike(self, user, post):
+        return self.remove_pair(user=user, post=post)
+
+    def get_liked_post_ids(self, user, post_ids):
+        return set(self.get_queryset().filter(
+            user=user, post__in=post_ids).values_list("post_id", flat=True))
+
+
 class Like(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name="liker")
@@ -76,9 +235,162 @@ class Like(models.Model):
                              related_name="liked_post")
     created = models.DateTimeField("like_date",
                                    auto_now_add=True, db_index=True)
+    objects = LikeManager()
 
     class Meta:
         ordering = ("-created",)
+        unique_together = ("user", "post")
 
     def __str__(self):
         return f"liker - {self.user} liked post - {self.post} like's date - {self.created}"
+
+
+class FeedItemManager(models.Manager):
+    def fan_out(self, post):
+        if Follow.objects.is_pulled_author(post.author_id):
+            return
+        followers = Follow.objects.filter(
+            author=post.author_id).values_list("user_id", flat=True)
+        self.bulk_create(
+            [self.model(user_id=user_id, post=post, pub_date=post.pub_date)
+             for user_id in followers.iterator()],
+            batch_size=500, ignore_conflicts=True)
+
+    def backfill(self, user_id, author_id, since=None):
+        posts = Post.objects.filter(author=author_id)
+        if since is not None:
+            posts = posts.filter(pub_date__gte=since)
+        posts = posts.values_list("id", "pub_date")
+        self.bulk_create(
+            [self.model(user_id=user_id, post_id=post_id, pub_date=pub_date)
+             for post_id, pub_date in posts.iterator()],
+            batch_size=500, ignore_conflicts=True)
+
+    def prune(self, user_id, author_id):
+        self.get_queryset().filter(user=user_id,
+                                   post__author=author_id).delete()
+
+    def drop_pulled(self):
+        """Delete the rows left of pulled authors; reads merge their posts
+        in anyway, so this only frees space."""
+        deleted, _ = self.get_queryset().filter(
+            post__author__stats__feed_pulled=True).delete()
+        return deleted
+
+    def push(self, author_id):
+        """Backfill every follower of pulled ``author_id``, then push their
+        posts again from now on."""
+        started = timezone.now()
+        followers = Follow.objects.filter(author=author_id).values_list(
+            "user_id", flat=True)
+        for user_id in followers.iterator():
+            self.backfill(user_id, author_id)
+        ProfileStats.objects.filter(user=author_id).update(feed_pulled=False)
+        # Posts and follows made meanwhile were neither fanned out nor
+        # backfilled.
+        for user_id in followers.filter(created__gte=started).iterator():
+            self.backfill(user_id, author_id)
+        for user_id in followers.filter(created__lt=started).iterator():
+            self.backfill(user_id, author_id, since=started)
+
+
+class FeedItem(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name="feed_items")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name="feed_items")
+    pub_date = models.DateTimeField("date_published")
+    objects = FeedItemManager()
+
+    class Meta:
+        ordering = ("-pub_date",)
+        unique_together = ("user", "post")
+        indexes = (
+            models.Index(fields=("user", "-pub_date", "-post"),
+                         name="feed_item_keyset_idx"),
+        )
+
+    def __str__(self):
+        return f"reader - {self.user} post - {self.post}"
+
+
+class ProfileStatsManager(models.Manager):
+    def get_for(self, user):
+        try:
+            return user.stats
+        except self.model.DoesNotExist:
+            return self.recount(user.pk)
+
+    def recount(self, user_id):
+        counts = {
+            "followers_count": Follow.objects.filter(author=user_id).count(),
+            "following_count": Follow.objects.filter(user=user_id).count(),
+            "posts_count": Post.objects.filter(author=user_id).count(),
+        }
+        stats, _ = self.update_or_create(user_id=user_id, defaults=counts)
+        return stats
+
+    def add_to_counters(self, user_id, **deltas):
+        return self.get_queryset().filter(user=user_id).update(
+            **{field: F(field) + delta for field, delta in deltas.items()})
+
+    def pull_if_popular(self, user_id):
+        """Have the posts of ``user_id`` pulled at read time once they have
+        more than ``FEED_FANOUT_FOLLOWER_LIMIT`` followers."""
+        return self.get_queryset().filter(
+            user=user_id, feed_pulled=False,
+            followers_count__gt=settings.FEED_FANOUT_FOLLOWER_LIMIT).update(
+            feed_pulled=True)
+
+    def get_pushable(self):
+        """Ids of the pulled authors back at or under
+        ``FEED_FANOUT_RESUME_LIMIT`` followers."""
+        return self.get_queryset().filter(
+            feed_pulled=True,
+            followers_count__lte=settings.FEED_FANOUT_RESUME_LIMIT,
+        ).values_list("user_id", flat=True)
+
+
+class ProfileStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                related_name="stats")
+    followers_count = models.PositiveIntegerField("followers_count",
+                                                  default=0)
+    following_count = models.PositiveIntegerField("following_count",
+                                                  default=0)
+    posts_count = models.PositiveIntegerField("posts_count", default=0)
+    feed_pulled = models.BooleanField("feed_pulled", default=False)
+    objects = ProfileStatsManager()
+
+    def __str__(self):
+        return f"stats of {self.user}"
+
+
+class StoredImageManager(models.Manager):
+    def add_reference(self, name, count=1):
+        """Count ``count`` posts using image ``name``; ``True`` if they are
+        the first."""
+        image, created = self.get_or_create(name=name,
+                                            defaults={"references": count})
+        if not created:
+            self.get_queryset().filter(pk=image.pk).update(
+                references=F("references") + count)
+        return created
+
+    def remove_reference(self, name):
+        """Uncount a post using image ``name``; ``True`` if it was the last
+        one and the image can go."""
+        self.get_queryset().filter(name=name, references__gt=0).update(
+            references=F("references") - 1)
+        deleted, _ = self.get_queryset().filter(name=name,
+                                                references=0).delete()
+        return bool(deleted)
+
+
+class StoredImage(models.Model):
+    name = models.CharField("name", max_length=100, unique=True)
+    references = models.PositiveIntegerField("references", default=0)
+    objects = StoredImageManager()
+
+    def __str__(self):
+        return f"{self.name} ({self.references})"
@@ -0,0 +1,247 @@
+import base64
+import binascii
+import math
+from collections import namedtuple
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .cache import get_or_build
+
+PageLink = namedtuple("PageLink", ("number", "query", "current"))
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(date, pk, number):
+    key = date.isoformat() if hasattr(date, "isoformat") else repr(date)
+    raw = f"{key}|{pk}|{number}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, parse_key=parse_datetime):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        date, pk, number = raw.decode().split("|")
+        date, pk, number = parse_key(date), int(pk), int(number)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(token)
+    if date is None:
+        raise InvalidCursor(token)
+    return date, pk, max(number, 1)
+
+
+def count_cache_key(scope):
+    return f"paginator_count:{scope}"
+
+
+def keyset_range(queryset, date_field, pk_field,
+                 date=None, pk=None, reverse=False):
+    lookup = "gt" if reverse else "lt"
+    if date is not None:
+        queryset = queryset.filter(
+            Q(**{f"{date_field}__{lookup}": date})
+            | Q(**{date_field: date, f"{pk_field}__{lookup}": pk}))
+    if reverse:
+        return queryset.order_by(date_field, pk_field)
+    return queryset.order_by(f"-{date_field}", f"-{pk_field}")
+
+
+class KeysetPage(Sequence):
+    def __init__(self, object_list, number, paginator,
+                 has_previous=False, has_next=False):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return f"<Page {self.number}>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return self.paginator.cursor_for(self.object_list[-1],
+                                         self.number + 1)
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[0],
+                                         self.number - 1)
+
+    @cached_property
+    def page_links(self):
+        return self.paginator.get_page_links(self)
+
+
+class KeysetPaginator:
+    """Paginate a newest-first list by ``(date_field, pk)`` instead of
+    ``OFFSET``, so every page costs one indexed range scan.
+
+    Pages are addressed by opaque ``after``/``before`` cursors taken from
+    the last/first item of the neighbouring page.
+    """
+
+    def __init__(self, object_list, per_page, date_field="pub_date",
+                 window=2, count_scope=None):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.date_field = date_field
+        self.window = window
+        self.count_scope = count_scope
+
+    @cached_property
+    def count(self):
+        """Number of items, or ``None`` without a ``count_scope``.
+
+        The count is cached under the scope until a post is added to or
+        removed from it. Past ``PAGINATOR_COUNT_LIMIT`` counting stops and
+        the limit is returned as an approximate lower bound.
+        """
+        if self.count_scope is None:
+            return None
+        limit = settings.PAGINATOR_COUNT_LIMIT
+        return get_or_build(
+            count_cache_key(self.count_scope),
+            lambda: self.object_list.order_by()[:limit + 1].count(),
+            settings.PAGINATOR_COUNT_TIMEOUT)
+
+    @property
+    def count_is_exact(self):
+        return self.count is not None and (
+            self.count <= settings.PAGINATOR_COUNT_LIMIT)
+
+    @property
+    def num_pages(self):
+        if self.count is None:
+            return None
+        return max(math.ceil(min(self.count, settings.PAGINATOR_COUNT_LIMIT)
+                             / self.per_page), 1)
+
+    def cursor_for(self, obj, number):
+        return encode_cursor(getattr(obj, self.date_field), obj.pk, number)
+
+    def get_page(self, after=None, before=None):
+        """Return the page past the ``after`` or ``before`` cursor, or the
+        first page. Cursor keys are dates unless ``object_list`` provides
+        its own ``parse_key()``."""
+        parse_key = getattr(self.object_list, "parse_key", parse_datetime)
+        try:
+            if after:
+                return self._page_after(*decode_cursor(after, parse_key))
+            if before:
+                return self._page_before(*decode_cursor(before, parse_key))
+        except InvalidCursor:
+            pass
+        return self._first_page()
+
+    def _slice(self, date=None, pk=None, reverse=False):
+        """Return up to ``per_page + 1`` items strictly past the cursor,
+        newest first, or oldest first when walking backwards.
+
+        ``object_list`` may provide its own ``keyset_slice()`` when the
+        items do not come from a single queryset.
+        """
+        limit = self.per_page + 1
+        if hasattr(self.object_list, "keyset_slice"):
+            return self.object_list.keyset_slice(date, pk, reverse, limit)
+        queryset = keyset_range(self.object_list, self.date_field, "pk",
+                                date, pk, reverse)
+        return list(queryset[:limit])
+
+    def get_page_links(self, page):
+        """Return links to the pages within ``window`` of ``page``, with
+        ``None`` standing for an elided run of pages.
+
+        Neighbouring cursors come from one keys-only range query in each
+        direction, so the cost does not grow with the size of the list.
+        """
+        span = self.window * self.per_page
+        before, after = [], []
+        number = page.number
+        if page.has_previous() and page.object_list:
+            keys = self._keys(*self._key(page.object_list[0]), reverse=True,
+                              limit=span + self.per_page + 1)
+            if len(keys) <= span + self.per_page:
+                number = page.number = math.ceil(
+                    len(keys) / self.per_page) + 1
+            else:
+                number = page.number = max(number, self.window + 2)
+            for offset in range(min(number - 1, self.window)):
+                key = (keys[offset * self.per_page - 1] if offset
+                       else self._key(page.object_list[0]))
+                target = number - offset - 1
+                query = "" if target == 1 else "before=" + encode_cursor(
+                    *key, target)
+                before.insert(0, PageLink(target, query, False))
+            if number - self.window > 1:
+                if number - self.window > 2:
+                    before.insert(0, None)
+                before.insert(0, PageLink(1, "", False))
+        if page.has_next():
+            keys = self._keys(*self._key(page.object_list[-1]),
+                              limit=span + 1)
+            for offset in range(math.ceil(min(len(keys), span)
+                                          / self.per_page)):
+                key = (keys[offset * self.per_page - 1] if offset
+                       else self._key(page.object_list[-1]))
+                after.append(PageLink(
+                    number + offset + 1,
+                    "after=" + encode_cursor(*key, number + offset + 1),
+                    False))
+            if len(keys) > span:
+                after.append(None)
+        return before + [PageLink(number, "", True)] + after
+
+    def _key(self, obj):
+        return getattr(obj, self.date_field), obj.pk
+
+    def _keys(self, date, pk, reverse=False, limit=None):
+        if hasattr(self.object_list, "keyset_keys"):
+            return self.object_list.keyset_keys(date, pk, reverse, limit)
+        queryset = keyset_range(
+            self.object_list.values_list(self.date_field, "pk"),
+            self.date_field, "pk", date, pk, reverse)
+        return list(queryset[:limit])
+
+    def _first_page(self):
+        rows = self._slice()
+        return KeysetPage(rows[:self.per_page], 1, self,
+                          has_next=len(rows) > self.per_page)
+
+    def _page_after(self, date, pk, number):
+        rows = self._slice(date, pk)
+        return KeysetPage(rows[:self.per_page], max(number, 2), self,
+                          has_previous=True,
+                          has_next=len(rows) > self.per_page)
+
+    def _page_before(self, date, pk, number):
+        rows = self._slice(date, pk, reverse=True)
+        if len(rows) <= self.per_page:
+            return self._first_page()
+        return KeysetPage(rows[:self.per_page][::-1], max(number, 2), self,
+                          has_previous=True, has_next=True)
@@ -0,0 +1,76 @@
+import json
+import re
+from collections import namedtuple
+from html import unescape
+
+from django.template.loader import render_to_string
+from django.utils.html import escape
+
+from .models import Follow, Like
+
+Part = namedtuple("Part", ("template", "viewer_kwargs", "load"))
+
+MARKER_RE = re.compile(r"<!--personal (.*?)-->")
+
+
+def load_like_state(user, parts):
+    liked = set()
+    if user.is_authenticated:
+        liked = Like.objects.get_liked_post_ids(
+            user, [kwargs["post_id"] for kwargs in parts])
+    for kwargs in parts:
+        kwargs["is_liked"] = kwargs["post_id"] in liked
+
+
+def load_follow(user, parts):
+    for kwargs in parts:
+        kwargs["follow"] = None
+        if user.is_authenticated:
+            kwargs["follow"] = Follow.objects.get_follow(
+                kwargs["author_id"], user).first()
+
+
+PARTS = {
+    "nav": Part("nav.html", (), None),
+    "menu": Part("posts/menu.html", (), None),
+    "post_actions": Part("posts/post_actions.html", ("is_liked",),
+                         load_like_state),
+    "profile_follow": Part("posts/profile_follow.html", ("follow",),
+                           load_follow),
+}
+
+
+def render_part(request, name, kwargs):
+    return render_to_string(PARTS[name].template, kwargs, request=request)
+
+
+def part_marker(name, kwargs):
+    """Stand-in for a viewer's part in a cached page shell.
+
+    The viewer-specific arguments are left out; ``fill_parts`` loads them
+    for the viewer the shell is served to.
+    """
+    kwargs = {key: value for key, value in kwargs.items()
+              if key not in PARTS[name].viewer_kwargs}
+    # Escaped so that no argument can end the comment early.
+    return f"<!--personal {escape(json.dumps([name, kwargs]))}-->"
+
+
+def fill_parts(request, html):
+    """Render the parts marked in ``html`` for ``request.user``.
+
+    Viewer data is loaded once per kind of part, so filling a page of
+    posts costs one like query however many posts it shows.
+    """
+    markers = MARKER_RE.findall(html)
+    parts = {}
+    for marker in markers:
+        name, kwargs = json.loads(unescape(marker))
+        parts.setdefault(name, []).append((marker, kwargs))
+    rendered = {}
+    for name, found in parts.items():
+        if PARTS[name].load is not None:
+            PARTS[name].load(request.user, [kwargs for _, kwargs in found])
+        for marker, kwargs in found:
+            rendered[marker] = render_part(request, name, kwargs)
+    return MARKER_RE.sub(lambda match: rendered[match.group(1)], html)
@@ -0,0 +1,138 @@
+import math
+import re
+
+from django.db import connection
+
+from .models import Post
+
+SEARCH_TABLE = "posts_post_search"
+
+SEARCH_MAX_TERMS = 8
+
+CREATE_SEARCH_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "text, group_title, author, tokenize='unicode61 remove_diacritics 2')")
+
+
+def search_enabled():
+    """The index is an SQLite FTS5 table; other databases go without."""
+    return connection.vendor == "sqlite"
+
+
+def match_expression(query):
+    """FTS5 query matching posts with every word of ``query`` as a prefix,
+    or ``None`` without any word. User input never reaches the FTS5 query
+    syntax unquoted."""
+    words = re.findall(r"\w+", query)[:SEARCH_MAX_TERMS]
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def index_posts(posts):
+    """(Re)index the posts of queryset ``posts``."""
+    if not search_enabled():
+        return
+    rows = posts.order_by().values_list("id", "text", "group__title",
+                                        "author__username")
+    with connection.cursor() as cursor:
+        batch = []
+        for post_id, text, group_title, author in rows.iterator():
+            batch.append((post_id, text, group_title or "", author))
+            if len(batch) == 500:
+                _replace_rows(cursor, batch)
+                batch = []
+        if batch:
+            _replace_rows(cursor, batch)
+
+
+def _replace_rows(cursor, rows):
+    cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+                       [(row[0],) for row in rows])
+    cursor.executemany(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, text, group_title, author) "
+        "VALUES (%s, %s, %s, %s)", rows)
+
+
+def unindex_posts(post_ids):
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+                           [(post_id,) for post_id in post_ids])
+
+
+def rebuild_index():
+    """Empty the index and index every post again; returns the number of
+    posts indexed."""
+    if not search_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_SEARCH_TABLE)
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    index_posts(Post.objects.all())
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) "
+                       "VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {SEARCH_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def matching_ids_sql(query):
+    """``(sql, params)`` selecting the ids of the posts matching
+    ``query``, for use as a subquery."""
+    return (f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} "
+            "MATCH %s", [match_expression(query) or '""'])
+
+
+def parse_rank(raw):
+    try:
+        rank = float(raw)
+    except ValueError:
+        return None
+    return rank if math.isfinite(rank) else None
+
+
+class PostSearch:
+    """Posts matching ``query``, best match first, for ``KeysetPaginator``
+    with ``date_field="rank"``.
+
+    ``rank`` is the negated BM25 score of the post, so better matches rank
+    higher, and pages are keyed by ``(rank, id)`` like the other lists
+    are keyed by ``(pub_date, id)``.
+    """
+
+    parse_key = staticmethod(parse_rank)
+
+    def __init__(self, query):
+        self.query = query
+        self.expression = match_expression(query)
+
+    def keyset_keys(self, rank, pk, reverse, limit):
+        if self.expression is None or not search_enabled():
+            return []
+        lookup, order = (">", "ASC") if reverse else ("<", "DESC")
+        sql = (f"SELECT score, id FROM (SELECT -bm25({SEARCH_TABLE}) "
+               f"AS score, rowid AS id FROM {SEARCH_TABLE} "
+               f"WHERE {SEARCH_TABLE} MATCH %s)")
+        params = [self.expression]
+        if rank is not None:
+            sql += (f" WHERE score {lookup} %s "
+                    f"OR (score = %s AND id {lookup} %s)")
+            params += [rank, rank, pk]
+        sql += f" ORDER BY score {order}, id {order} LIMIT %s"
+        params.append(-1 if limit is None else limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def keyset_slice(self, rank, pk, reverse, limit):
+        keys = self.keyset_keys(rank, pk, reverse, limit)
+        posts = Post.objects.get_feed().in_bulk(
+            [post_id for _, post_id in keys])
+        found = []
+        for rank, post_id in keys:
+            if post_id in posts:
+                posts[post_id].rank = rank
+                found.append(posts[post_id])
+        return found
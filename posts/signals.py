@@ -0,0 +1,262 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from .cache import bump_generations
+from .models import (Comment, FeedItem, Follow, Group, Like, Post,
+                     ProfileStats, StoredImage, User)
+from .paginator import count_cache_key
+from .search import index_posts, unindex_posts
+from .storage import content_name
+from .thumbnails import delete_image, pregenerate_thumbnails
+
+
+@receiver(post_save, sender=User)
+def create_profile_stats(sender, instance, created, **kwargs):
+    if created:
+        ProfileStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_init, sender=Post)
+def remember_loaded_fields(sender, instance, **kwargs):
+    instance._loaded_group_id = instance.group_id
+    image = instance.image
+    instance._loaded_image = image.name if image._committed else None
+
+
+@receiver(post_save, sender=Post)
+def reset_post_caches(sender, instance, created, **kwargs):
+    if not created:
+        Post.objects.add_to_counters(instance.pk, version=1)
+    scopes = instance.get_cache_scopes()
+    bump_generations(scopes)
+    if created or instance.group_id != instance._loaded_group_id:
+        cache.delete_many([count_cache_key(scope) for scope in scopes])
+    instance._loaded_group_id = instance.group_id
+
+
+# Ids of the posts being deleted, whose comments and likes go with them in
+# the cascade without touching the post.
+deleting_post_ids = set()
+
+
+@receiver(pre_delete, sender=Post)
+def remember_deleting_post(sender, instance, **kwargs):
+    deleting_post_ids.add(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def forget_deleting_post(sender, instance, **kwargs):
+    deleting_post_ids.discard(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def reset_deleted_post_caches(sender, instance, **kwargs):
+    scopes = instance.get_cache_scopes()
+    bump_generations(scopes)
+    cache.delete_many([count_cache_key(scope) for scope in scopes])
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        FeedItem.objects.fan_out(instance)
+        ProfileStats.objects.add_to_counters(instance.author_id,
+                                             posts_count=1)
+
+
+@receiver(pre_save, sender=Post)
+def name_image_by_content(sender, instance, **kwargs):
+    image = instance.image
+    if image and not image._committed:
+        image.name = content_name(image.file)
+
+
+def release_image(name):
+    if StoredImage.objects.remove_reference(name):
+        storage = Post._meta.get_field("image").storage
+
+        def delete_unused():
+            if not StoredImage.objects.filter(name=name).exists():
+                delete_image(name, storage)
+        transaction.on_commit(delete_unused)
+
+
+@receiver(post_save, sender=Post)
+def track_post_image(sender, instance, **kwargs):
+    name = instance.image.name or None
+    if name != instance._loaded_image:
+        # Images already stored have their thumbnails already.
+        if name and StoredImage.objects.add_reference(name):
+            transaction.on_commit(lambda: pregenerate_thumbnails([name]))
+        if instance._loaded_image:
+            release_image(instance._loaded_image)
+    instance._loaded_image = name
+
+
+@receiver(post_delete, sender=Post)
+def release_post_image(sender, instance, **kwargs):
+    if instance._loaded_image:
+        release_image(instance._loaded_image)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    ProfileStats.objects.add_to_counters(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    index_posts(Post.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    unindex_posts([instance.pk])
+
+
+@receiver(post_init, sender=Group)
+def remember_loaded_group(sender, instance, **kwargs):
+    instance._loaded_slug = instance.__dict__.get("slug")
+    instance._loaded_title = instance.__dict__.get("title")
+
+
+@receiver(post_save, sender=Group)
+def reset_group_pages(sender, instance, created, **kwargs):
+    # Post cards show the title and link the slug.
+    if not created and (instance._loaded_slug, instance._loaded_title) != (
+            instance.slug, instance.title):
+        Post.objects.bump_versions(group=instance)
+    scopes = instance.get_cache_scopes()
+    if instance._loaded_slug not in (None, instance.slug):
+        scopes.add(f"group:{instance._loaded_slug}")
+    bump_generations(scopes)
+    instance._loaded_slug = instance.slug
+    instance._loaded_title = instance.title
+
+
+@receiver(post_save, sender=Group)
+def reindex_group_posts(sender, instance, created, **kwargs):
+    if not created:
+        index_posts(Post.objects.filter(group=instance))
+
+
+@receiver(pre_delete, sender=Group)
+def remember_group_posts(sender, instance, **kwargs):
+    instance._post_ids = list(instance.group_posts.values_list("id",
+                                                               flat=True))
+    instance._cache_scopes = instance.get_cache_scopes()
+
+
+@receiver(post_delete, sender=Group)
+def reindex_ungrouped_posts(sender, instance, **kwargs):
+    index_posts(Post.objects.filter(pk__in=instance._post_ids))
+    Post.objects.bump_versions(pk__in=instance._post_ids)
+    bump_generations(instance._cache_scopes)
+
+
+@receiver(post_init, sender=User)
+def remember_loaded_username(sender, instance, **kwargs):
+    instance._loaded_username = instance.__dict__.get("username")
+
+
+@receiver(post_save, sender=User)
+def reset_author_pages(sender, instance, created, **kwargs):
+    old = instance._loaded_username
+    if not created and old not in (None, instance.username):
+        Post.objects.bump_versions(author=instance)
+        slugs = Group.objects.filter(
+            group_posts__author=instance).values_list(
+            "slug", flat=True).distinct()
+        bump_generations({"index", f"profile:{old}",
+                          f"profile:{instance.username}"}
+                         | {f"group:{slug}" for slug in slugs})
+    instance._loaded_username = instance.username
+
+
+@receiver(post_save, sender=User)
+def reindex_author_posts(sender, instance, created, update_fields, **kwargs):
+    # Logins only save last_login.
+    if not created and (update_fields is None
+                        or "username" in update_fields):
+        index_posts(Post.objects.filter(author=instance))
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        ProfileStats.objects.add_to_counters(instance.author_id,
+                                             followers_count=1)
+        ProfileStats.objects.add_to_counters(instance.user_id,
+                                             following_count=1)
+        # Only the flag flips here; sync_feed_fanout drops the pushed rows
+        # of pulled authors and pushes those back under the resume limit.
+        ProfileStats.objects.pull_if_popular(instance.author_id)
+        if not Follow.objects.is_pulled_author(instance.author_id):
+            FeedItem.objects.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_feed(sender, instance, **kwargs):
+    FeedItem.objects.prune(instance.user_id, instance.author_id)
+    ProfileStats.objects.add_to_counters(instance.author_id,
+                                         followers_count=-1)
+    ProfileStats.objects.add_to_counters(instance.user_id,
+                                         following_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.add_to_counters(instance.post_id, comment_count=1,
+                                     version=1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    if instance.post_id in deleting_post_ids:
+        return
+    Post.objects.add_to_counters(instance.post_id, comment_count=-1,
+                                 version=1)
+
+
+@receiver(post_save, sender=Like)
+def count_like(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.add_to_counters(instance.post_id, like_count=1,
+                                     version=1)
+
+
+@receiver(post_delete, sender=Like)
+def uncount_like(sender, instance, **kwargs):
+    if instance.post_id in deleting_post_ids:
+        return
+    Post.objects.add_to_counters(instance.post_id, like_count=-1,
+                                 version=1)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Like)
+def reset_post_pages(sender, instance, created, **kwargs):
+    if created:
+        bump_generations(instance.post.get_cache_scopes())
+
+
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Like)
+def reset_deleted_post_pages(sender, instance, **kwargs):
+    # The post's own delete resets its pages once for the whole cascade.
+    if instance.post_id in deleting_post_ids:
+        return
+    post = Post.objects.get_feed().filter(pk=instance.post_id).first()
+    if post is not None:
+        bump_generations(post.get_cache_scopes())
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def reset_profile_pages(sender, instance, **kwargs):
+    bump_generations({f"profile:{instance.author.username}",
+                      f"profile:{instance.user.username}"})
@@ -0,0 +1,12 @@
+// "Load more comments" appends the next page of comment_list.html in place
+// of the link, which comes back with the link to the page after it.
+$(document).on("click", "a.comments-more", function (event) {
+    var link = $(this);
+    event.preventDefault();
+    $.ajax({url: link.data("fragment-url"), dataType: "html"})
+    .done(function (html) {
+        link.replaceWith(html);
+    }).fail(function () {
+        window.location.href = link.attr("href");
+    });
+});
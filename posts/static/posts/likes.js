@@ -0,0 +1,15 @@
+// Toggle likes in place: the like links of post_actions.html answer XHR
+// requests with the new state, so the page is not rendered again.
+$(document).on("click", "a.like-toggle", function (event) {
+    var link = $(this);
+    event.preventDefault();
+    $.ajax({url: link.attr("href"), dataType: "json", cache: false})
+    .done(function (state) {
+        link.attr("href", state.toggle_url);
+        link.find(".like-glyph").html(state.liked ? "&#9829;" : "&#x2661;");
+        link.find(".like-count").text(
+            state.like_count > 0 ? state.like_count : "");
+    }).fail(function () {
+        window.location.href = link.attr("href");
+    });
+});
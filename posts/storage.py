@@ -0,0 +1,50 @@
+import hashlib
+import os
+import re
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+SHARDED_NAME_RE = re.compile(
+    r"(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$")
+
+
+class AlreadyStored(Exception):
+    pass
+
+
+def content_name(file):
+    """``ab/cd/abcd...<extension>`` for ``file``, named after the SHA-256
+    of its content and sharded by its first two bytes, so that no
+    directory holds more than 256 entries but the leaves."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    digest = digest.hexdigest()
+    extension = os.path.splitext(file.name)[1].lower()
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def is_sharded(name):
+    return SHARDED_NAME_RE.search(name) is not None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage for files named after their content.
+
+    A file saved under a name that is already taken has the same content,
+    so it is not written again and the existing name is returned.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        if self.exists(name):
+            raise AlreadyStored(name)
+        return name
+
+    def save(self, name, content, max_length=None):
+        try:
+            return super().save(name, content, max_length)
+        except AlreadyStored as stored:
+            return str(stored)
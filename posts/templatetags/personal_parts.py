@@ -0,0 +1,19 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts.personal import part_marker, render_part
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def personal(context, name, **kwargs):
+    """Render a part of the page that depends on the viewer.
+
+    In a page shell cached for all signed-in readers the part becomes a
+    marker that is filled in per request.
+    """
+    request = context["request"]
+    if getattr(request, "page_shell", False):
+        return mark_safe(part_marker(name, kwargs))
+    return mark_safe(render_part(request, name, kwargs))
@@ -0,0 +1,59 @@
+import logging
+
+from django import template
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail.conf import settings as sorl_settings
+
+from posts.cache import card_cache_key, card_stale_key, get_or_build
+from posts.thumbnails import card_variants
+
+logger = logging.getLogger(__name__)
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_card(post):
+    html = getattr(post, "card_html", None)
+    if html is None:
+        html = get_or_build(
+            card_cache_key(post),
+            lambda: render_to_string("posts/post_card.html", {"post": post}),
+            settings.POST_CARD_CACHE_TIMEOUT, stale_key=card_stale_key(post))
+    return mark_safe(html)
+
+
+def get_card_thumbnail(post, width, geometry, options):
+    thumbnail = getattr(post, "card_thumbnails", {}).get(width)
+    if thumbnail is None:
+        try:
+            thumbnail = get_thumbnail(post.image, geometry, **options)
+        except Exception:
+            # Like {% thumbnail %}: a broken image must not break the page.
+            if sorl_settings.THUMBNAIL_DEBUG:
+                raise
+            logger.exception("Thumbnail of %s failed", post.image.name)
+    return thumbnail
+
+
+@register.simple_tag
+def card_thumbnail(post):
+    if not post.image:
+        return None
+    geometry, options = settings.POST_CARD_THUMBNAIL
+    return get_card_thumbnail(post, None, geometry, options)
+
+
+@register.simple_tag
+def card_srcset(post):
+    if not post.image:
+        return ""
+    sources = []
+    for width, geometry, options in card_variants():
+        thumbnail = get_card_thumbnail(post, width, geometry, options)
+        if thumbnail is not None:
+            sources.append(f"{thumbnail.url} {width}w")
+    return ", ".join(sources)
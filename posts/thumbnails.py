@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import EXTENSIONS, ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import serialize, tokey
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import KVStoreBase, add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as CachedDBKVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+def digest_cache_key(name):
+    return f"image_digest:{name}"
+
+
+def compute_digest(name):
+    digest = hashlib.sha256()
+    try:
+        with default.storage.open(name) as image:
+            for chunk in image.chunks():
+                digest.update(chunk)
+    except (OSError, SuspiciousOperation):
+        return None
+    return digest.hexdigest()
+
+
+def get_digests(names):
+    """Map image ``names`` to the SHA-256 of their content, or ``None``
+    for files that cannot be read. Digests are cached for good, as an
+    uploaded file is never rewritten under the same name."""
+    keys = {digest_cache_key(name): name for name in names}
+    digests = {keys[key]: digest
+               for key, digest in cache.get_many(keys).items()}
+    missing = {}
+    for name in set(names) - set(digests):
+        digests[name] = compute_digest(name)
+        if digests[name] is not None:
+            missing[digest_cache_key(name)] = digests[name]
+    if missing:
+        cache.set_many(missing, None)
+    return digests
+
+
+def delete_image(name, storage, thumbnails=True):
+    """Delete image ``name`` from ``storage``, and its thumbnails unless
+    the same content lives on under another name."""
+    try:
+        default.kvstore.delete(ImageFile(name), delete_thumbnails=thumbnails)
+        storage.delete(name)
+    except (OSError, SuspiciousOperation):
+        pass
+    cache.delete(digest_cache_key(name))
+
+
+class ContentAddressedBackend(ThumbnailBackend):
+    """Names thumbnails after the content of their source, so a thumbnail
+    URL always serves the same bytes and can be cached forever."""
+
+    def _get_thumbnail_filename(self, source, geometry_string, options):
+        if hasattr(source, "digest"):
+            digest = source.digest
+        else:
+            digest = get_digests([source.name])[source.name]
+        if digest is None:
+            return super()._get_thumbnail_filename(source, geometry_string,
+                                                   options)
+        key = tokey(digest, geometry_string, serialize(options))
+        return "%s%s/%s/%s.%s" % (sorl_settings.THUMBNAIL_PREFIX, key[:2],
+                                  key[2:4], key, EXTENSIONS[options["format"]])
+
+
+class FileOnlyKVStore(KVStoreBase):
+    """Key value store of pool workers: they only write thumbnail files,
+    which the web processes find on disk and record themselves."""
+
+    def set(self, image_file, source=None):
+        pass
+
+    def _get_raw(self, key):
+        return None
+
+    def _set_raw(self, key, value):
+        pass
+
+    def _delete_raw(self, *keys):
+        pass
+
+    def _find_keys_raw(self, prefix):
+        return []
+
+
+def card_variants():
+    """``(width, geometry, options)`` of the ``srcset`` variants of the
+    card image: ``POST_CARD_THUMBNAIL`` scaled to each of
+    ``POST_CARD_WIDTHS``."""
+    geometry, options = settings.POST_CARD_THUMBNAIL
+    width, height = (int(side) for side in geometry.split("x"))
+    variants = []
+    for variant_width in settings.POST_CARD_WIDTHS:
+        variant_height = round(height * variant_width / width)
+        variants.append((variant_width, f"{variant_width}x{variant_height}",
+                         dict(options, **settings.POST_CARD_VARIANT_OPTIONS)))
+    return variants
+
+
+def render_thumbnails(name):
+    """Write every ``THUMBNAIL_GEOMETRIES`` thumbnail of image ``name``,
+    and the card variants."""
+    geometries = list(settings.THUMBNAIL_GEOMETRIES)
+    geometries += [(geometry, options)
+                   for _, geometry, options in card_variants()]
+    for geometry, options in geometries:
+        get_thumbnail(name, geometry, **options)
+    return name
+
+
+def render_thumbnails_in_worker(name):
+    default.kvstore._wrapped = FileOnlyKVStore()
+    return render_thumbnails(name)
+
+
+def get_pool(workers=None):
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=workers or settings.THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=django.setup)
+    return _pool
+
+
+def pregenerate_thumbnails(names):
+    """Render the thumbnails of ``names`` in the worker pool, so that no
+    request has to decode and resize an original.
+
+    Returns the futures, which log their failures, or renders in process
+    with ``THUMBNAIL_WORKERS`` set to 0.
+    """
+    if not settings.THUMBNAIL_WORKERS:
+        for name in names:
+            render_thumbnails(name)
+        return []
+    pool = get_pool()
+    futures = []
+    for name in names:
+        future = pool.submit(render_thumbnails_in_worker, name)
+        future.add_done_callback(partial(log_render_failure, name))
+        futures.append(future)
+    return futures
+
+
+def log_render_failure(name, future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Thumbnails of %s failed", name,
+                     exc_info=future.exception())
+
+
+def thumbnail_file(name, geometry, options, digest=None):
+    """The thumbnail ``get_thumbnail(name, geometry, **options)`` returns,
+    named the same way but neither looked up nor rendered."""
+    backend = default.backend
+    source = ImageFile(name)
+    source.digest = digest
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault("format", backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return ImageFile(backend._get_thumbnail_filename(source, geometry, options),
+                     default.storage)
+
+
+def prefetch_card_thumbnails(posts):
+    """Set ``card_thumbnails`` on ``posts``, the card image under ``None``
+    and its variants under their width, from one cache multi-get and one
+    query for the entries missing from the cache, instead of a key value
+    store lookup per thumbnail.
+
+    Only done for the default cached database key value store.
+    """
+    store = default.kvstore
+    if not isinstance(store, CachedDBKVStore):
+        return
+    posts = [post for post in posts if post.image]
+    digests = get_digests([post.image.name for post in posts])
+    geometry, options = settings.POST_CARD_THUMBNAIL
+    thumbnails = [(None, geometry, options)] + card_variants()
+    targets = {}
+    for post in posts:
+        post.card_thumbnails = {}
+        for width, geometry, options in thumbnails:
+            thumbnail = thumbnail_file(post.image.name, geometry, options,
+                                       digests[post.image.name])
+            targets[add_prefix(thumbnail.key)] = (post, width)
+    if not targets:
+        return
+    values = store.cache.get_many(targets)
+    missing = [key for key in targets if key not in values]
+    if missing:
+        found = dict(KVStoreModel.objects.filter(key__in=missing).values_list(
+            "key", "value"))
+        store.cache.set_many({key: found.get(key, EMPTY_VALUE)
+                              for key in missing},
+                             sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(found)
+    for key, value in values.items():
+        if value != EMPTY_VALUE:
+            post, width = targets[key]
+            post.card_thumbnails[width] = deserialize_image_file(value)
@@ -7,6 +7,7 @@ urlpatterns = [
     path("group/<slug:slug>/", views.group_posts, name="group"),
     path("new/", views.new_post, name="new_post"),
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search, name="search"),
     path("<username>/", views.profile, name="profile"),
     path("<username>/follow/", views.profile_follow, name="profile_follow"),
     path("<username>/unfollow/", views.profile_unfollow,
@@ -21,4 +22,6 @@ urlpatterns = [
          views.post_delete, name="post_delete"),
     path("<username>/<int:post_id>/comment/", views.add_comment,
          name="add_comment"),
+    path("<username>/<int:post_id>/comments/", views.post_comments,
+         name="post_comments"),
 ]
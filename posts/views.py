@@ -1,29 +1,46 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
-from django.http import HttpResponseRedirect
+from django.db import transaction
+from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.urls import reverse
+from django.utils.http import urlencode
 
+from .cache import cache_page_per_generation, prefetch_post_cards
+from .feeds import FollowFeed, mark_liked_posts
 from .forms import PostForm, CommentForm
-from .models import Group, Post, User, Follow, Like
+from .models import Group, Post, User, Follow, Like, ProfileStats
+from .paginator import KeysetPaginator
+from .search import PostSearch
 
 
-@cache_page(10)
+def get_post_or_404(username, post_id):
+    return get_object_or_404(Post.objects.get_feed().select_related(
+        "author__stats"), author__username=username, id=post_id)
+
+
+@cache_page_per_generation("index")
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.get_feed()
+    paginator = KeysetPaginator(post_list, 10, count_scope="index")
+    page = paginator.get_page(after=request.GET.get("after"),
+                              before=request.GET.get("before"))
+    mark_liked_posts(page, request.user)
+    prefetch_post_cards(page)
     data = {"page": page, "paginator": paginator}
     return render(request, "index.html", data)
 
 
+@cache_page_per_generation("group:{slug}")
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts_list = group.group_posts.all()
-    paginator = Paginator(posts_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    posts_list = Post.objects.get_feed().filter(group=group)
+    paginator = KeysetPaginator(posts_list, 10,
+                                count_scope=f"group:{group.slug}")
+    page = paginator.get_page(after=request.GET.get("after"),
+                              before=request.GET.get("before"))
+    mark_liked_posts(page, request.user)
+    prefetch_post_cards(page)
     data = {"group": group, "paginator": paginator, "page": page}
     return render(request, "group.html", data)
 
@@ -42,36 +59,59 @@ def new_post(request):
     return render(request, "posts/new_post.html", {"form": form})
 
 
+@cache_page_per_generation("profile:{username}")
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.author_posts.filter(author=author)
-    follow = Follow.objects.get_follow(author,
-                                       request.user) if request.user.is_authenticated else None
-    follow_date = Follow.objects.get(user=request.user,
-                                     author=author).created if follow.__bool__() else None
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    author = get_object_or_404(User.objects.select_related("stats"),
+                               username=username)
+    posts = Post.objects.get_feed().filter(author=author)
+    follow = None
+    if request.user.is_authenticated:
+        follow = Follow.objects.get_follow(author, request.user).first()
+    paginator = KeysetPaginator(posts, 10,
+                                count_scope=f"profile:{author.username}")
+    page = paginator.get_page(after=request.GET.get("after"),
+                              before=request.GET.get("before"))
+    mark_liked_posts(page, request.user)
+    prefetch_post_cards(page)
     data = {"author": author, "paginator": paginator,
-            "page": page, "follow": follow, "follow_date": follow_date}
+            "page": page, "follow": follow,
+            "stats": ProfileStats.objects.get_for(author)}
     return render(request, "posts/profile.html", data)
 
 
+def get_comment_page(request, post):
+    """The page of the comments of ``post`` past the ``after`` cursor,
+    newest first, with their authors joined in the same query."""
+    paginator = KeysetPaginator(post.post_comment.select_related("author"),
+                                settings.COMMENTS_PER_PAGE,
+                                date_field="created")
+    return paginator.get_page(after=request.GET.get("after"))
+
+
 def post_view(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post = get_object_or_404(author.author_posts, id=post_id)
-    comments = post.post_comment.all()
-    like = Like.objects.filter(user=request.user,
-                               post=post).exists() if request.user.is_authenticated else None
-    data = {"author": author, "post": post, "comments": comments,
-            "form": CommentForm(), "like": like}
+    post = get_post_or_404(username, post_id)
+    author = post.author
+    comment_page = get_comment_page(request, post)
+    mark_liked_posts([post], request.user)
+    prefetch_post_cards([post])
+    data = {"author": author, "post": post, "comment_page": comment_page,
+            "form": CommentForm(), "like": post.is_liked,
+            "stats": ProfileStats.objects.get_for(author)}
     return render(request, "posts/post.html", data)
 
 
+def post_comments(request, username, post_id):
+    post = get_object_or_404(Post.objects.select_related("author"),
+                             author__username=username, id=post_id)
+    return render(request, "posts/comment_list.html",
+                  {"post": post,
+                   "comment_page": get_comment_page(request, post)})
+
+
 @login_required
 def post_edit(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post = get_object_or_404(author.author_posts, id=post_id)
+    post = get_post_or_404(username, post_id)
+    author = post.author
     if request.user == author:
         form = PostForm(request.POST or None, files=request.FILES or None,
                         instance=post)
@@ -89,8 +129,8 @@ def post_edit(request, username, post_id):
 
 @login_required
 def post_delete(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post = get_object_or_404(author.author_posts, id=post_id)
+    post = get_post_or_404(username, post_id)
+    author = post.author
     if request.user == author:
         if request.method == "POST":
             post.delete()
@@ -109,15 +149,16 @@ def server_error(request):
 
 @login_required
 def add_comment(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post = get_object_or_404(author.author_posts, id=post_id)
+    post = get_post_or_404(username, post_id)
+    author = post.author
     if request.method == "POST":
         form = CommentForm(request.POST)
         if form.is_valid():
             comment = form.save(commit=False)
             comment.author = request.user
             comment.post = post
-            comment.save()
+            with transaction.atomic():
+                comment.save()
             return redirect("post", username=author, post_id=post.id)
     else:
         form = CommentForm()
@@ -127,41 +168,67 @@ def add_comment(request, username, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.get_following_posts(request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    paginator = KeysetPaginator(FollowFeed(request.user), 10)
+    page = paginator.get_page(after=request.GET.get("after"),
+                              before=request.GET.get("before"))
+    mark_liked_posts(page, request.user)
+    prefetch_post_cards(page)
     data = {"page": page, "paginator": paginator}
     return render(request, "posts/follow.html", data)
 
 
+def search(request):
+    query = request.GET.get("q", "").strip()
+    paginator = KeysetPaginator(PostSearch(query), 10, date_field="rank")
+    page = paginator.get_page(after=request.GET.get("after"),
+                              before=request.GET.get("before"))
+    mark_liked_posts(page, request.user)
+    prefetch_post_cards(page)
+    data = {"query": query, "page": page, "paginator": paginator,
+            "query_string": urlencode({"q": query})}
+    return render(request, "posts/search.html", data)
+
+
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
-        Follow.objects.get_or_create(user=request.user, author=author)
+        Follow.objects.follow(request.user, author)
     return redirect("profile", username=author)
 
 
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    Follow.objects.get_follow(author, request.user).delete()
+    Follow.objects.unfollow(request.user, author)
     return redirect("profile", username=author)
 
 
+def like_state_response(request, post, liked):
+    """The new like state as JSON for the in-place toggle of
+    ``post_actions.html``, or a redirect back for a plain link."""
+    if not request.is_ajax():
+        return HttpResponseRedirect(request.META.get("HTTP_REFERER"))
+    like_count = Post.objects.filter(pk=post.pk).values_list(
+        "like_count", flat=True).get()
+    toggle_url = reverse("delete_like" if liked else "add_like",
+                         kwargs={"username": post.author.username,
+                                 "post_id": post.id})
+    return JsonResponse({"liked": liked, "like_count": like_count,
+                         "toggle_url": toggle_url})
+
+
 @login_required
 def add_like(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post = get_object_or_404(author.author_posts, id=post_id)
+    post = get_post_or_404(username, post_id)
+    author = post.author
     if request.user != author:
-        Like.objects.get_or_create(user=request.user, post=post)
-    return HttpResponseRedirect(request.META.get("HTTP_REFERER"))
+        Like.objects.like(request.user, post)
+    return like_state_response(request, post, request.user != author)
 
 
 @login_required
 def delete_like(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post = get_object_or_404(author.author_posts, id=post_id)
-    Like.objects.filter(user=request.user, post=post).delete()
-    return HttpResponseRedirect(request.META.get("HTTP_REFERER"))
+    post = get_post_or_404(username, post_id)
+    Like.objects.unlike(request.user, post)
+    return like_state_response(request, post, False)
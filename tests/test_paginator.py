@@ -1,6 +1,6 @@
 import pytest
 
-from django.core.paginator import Paginator, Page
+from posts.paginator import KeysetPage, KeysetPaginator
 
 
 class TestGroupPaginatorView:
@@ -17,12 +17,12 @@ class TestGroupPaginatorView:
 
         assert 'paginator' in response.context, \
             'Проверьте, что передали переменную `paginator` в контекст страницы `/group/<slug>/`'
-        assert type(response.context['paginator']) == Paginator, \
-            'Проверьте, что переменная `paginator` на странице `/group/<slug>/` типа `Paginator`'
+        assert type(response.context['paginator']) == KeysetPaginator, \
+            'Проверьте, что переменная `paginator` на странице `/group/<slug>/` типа `KeysetPaginator`'
         assert 'page' in response.context, \
             'Проверьте, что передали переменную `page` в контекст страницы `/group/<slug>/`'
-        assert type(response.context['page']) == Page, \
-            'Проверьте, что переменная `page` на странице `/group/<slug>/` типа `Page`'
+        assert type(response.context['page']) == KeysetPage, \
+            'Проверьте, что переменная `page` на странице `/group/<slug>/` типа `KeysetPage`'
 
     @pytest.mark.django_db(transaction=True)
     def test_index_paginator_view_get(self, client, post_with_group):
@@ -30,9 +30,9 @@ class TestGroupPaginatorView:
         assert response.status_code != 404, 'Страница `/` не найдена, проверьте этот адрес в *urls.py*'
         assert 'paginator' in response.context, \
             'Проверьте, что передали переменную `paginator` в контекст страницы `/`'
-        assert type(response.context['paginator']) == Paginator, \
-            'Проверьте, что переменная `paginator` на странице `/` типа `Paginator`'
+        assert type(response.context['paginator']) == KeysetPaginator, \
+            'Проверьте, что переменная `paginator` на странице `/` типа `KeysetPaginator`'
         assert 'page' in response.context, \
             'Проверьте, что передали переменную `page` в контекст страницы `/`'
-        assert type(response.context['page']) == Page, \
-            'Проверьте, что переменная `page` на странице `/` типа `Page`'
+        assert type(response.context['page']) == KeysetPage, \
+            'Проверьте, что переменная `page` на странице `/` типа `KeysetPage`'
@@ -0,0 +1,272 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+class SQLiteCache(BaseCache):
+    """Cache kept in one SQLite file, shared by every worker process on
+    the host without an external cache service.
+
+    LOCATION is the path of the database file. The database runs in WAL
+    mode, so readers in other processes do not block on writers.
+    """
+
+    cull_every = 100
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+        self._sets = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=5,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, "
+                "value BLOB NOT NULL, expires REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_expires "
+                               "ON cache (expires)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _fetch(self, keys):
+        """Return ``{key: (blob, expires)}`` for the live ``keys``."""
+        found = {}
+        now = time.time()
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._connection().execute(
+                "SELECT key, value, expires FROM cache WHERE key IN "
+                f"({', '.join('?' * len(chunk))})", chunk)
+            for key, blob, expires in rows:
+                if expires is None or expires > now:
+                    found[key] = (blob, expires)
+        return found
+
+    def _store(self, items, expires):
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires) "
+                "VALUES (?, ?, ?)",
+                [(key, blob, expires) for key, blob in items])
+        self._sets += 1
+        if self._sets % self.cull_every == 0:
+            self._cull()
+
+    def _cull(self):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM cache WHERE expires <= ?",
+                               (time.time(),))
+            count = connection.execute(
+                "SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self._max_entries:
+                connection.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                    "ORDER BY expires IS NULL, expires LIMIT ?)",
+                    (count // self._cull_frequency,))
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        found = self._fetch([key])
+        if key not in found:
+            return default
+        return pickle.loads(found[key][0])
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        return {keys[key]: pickle.loads(blob)
+                for key, (blob, _) in self._fetch(keys).items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store([(self._key(key, version), self._dumps(value))],
+                    self.get_backend_timeout(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store([(self._key(key, version), self._dumps(value))
+                     for key, value in data.items()],
+                    self.get_backend_timeout(timeout))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+                "expires = excluded.expires WHERE cache.expires <= ?",
+                (key, self._dumps(value), self.get_backend_timeout(timeout),
+                 time.time()))
+        return cursor.rowcount == 1
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE cache SET expires = ? WHERE key = ? "
+                "AND (expires IS NULL OR expires > ?)",
+                (self.get_backend_timeout(timeout),
+                 self._key(key, version), time.time()))
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        with self._transaction() as connection:
+            found = self._fetch([key])
+            if key not in found:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(found[key][0]) + delta
+            connection.execute(
+                "UPDATE cache SET value = ? WHERE key = ?",
+                (self._dumps(value), key))
+        return value
+
+    def has_key(self, key, version=None):
+        return bool(self._fetch([self._key(key, version)]))
+
+    def delete(self, key, version=None):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM cache WHERE key = ?",
+                               (self._key(key, version),))
+
+    def delete_many(self, keys, version=None):
+        with self._transaction() as connection:
+            connection.executemany(
+                "DELETE FROM cache WHERE key = ?",
+                [(self._key(key, version),) for key in keys])
+
+    def clear(self):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM cache")
+
+
+class TieredSQLiteCache(SQLiteCache):
+    """``SQLiteCache`` behind an in-process LRU tier.
+
+    The local tier holds at most ``L1_MAX_BYTES`` of pickled values and
+    keeps each of them for at most ``L1_TIMEOUT`` seconds, which bounds how
+    long a write made by another process can go unseen here.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        options = params.get("OPTIONS", {})
+        self._l1_max_bytes = int(options.get("L1_MAX_BYTES", 8 * 2 ** 20))
+        self._l1_timeout = float(options.get("L1_TIMEOUT", 2))
+        self._l1 = OrderedDict()
+        self._l1_bytes = 0
+        self._l1_lock = threading.Lock()
+
+    def _l1_get(self, key):
+        with self._l1_lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                self._l1_drop(key)
+                return None
+            self._l1.move_to_end(key)
+            return entry[0]
+
+    def _l1_put(self, key, blob, expires):
+        if len(blob) > self._l1_max_bytes:
+            return
+        expires_l1 = time.time() + self._l1_timeout
+        if expires is not None:
+            expires_l1 = min(expires, expires_l1)
+        with self._l1_lock:
+            self._l1_drop(key)
+            self._l1[key] = (blob, expires_l1)
+            self._l1_bytes += len(blob)
+            while self._l1_bytes > self._l1_max_bytes:
+                self._l1_drop(next(iter(self._l1)))
+
+    def _l1_drop(self, key):
+        entry = self._l1.pop(key, None)
+        if entry is not None:
+            self._l1_bytes -= len(entry[0])
+
+    def _l1_forget(self, keys):
+        with self._l1_lock:
+            for key in keys:
+                self._l1_drop(key)
+
+    def _fetch(self, keys):
+        found, missing = {}, []
+        for key in keys:
+            blob = self._l1_get(key)
+            if blob is None:
+                missing.append(key)
+            else:
+                found[key] = (blob, None)
+        if missing:
+            fetched = super()._fetch(missing)
+            for key, (blob, expires) in fetched.items():
+                self._l1_put(key, blob, expires)
+            found.update(fetched)
+        return found
+
+    def _store(self, items, expires):
+        super()._store(items, expires)
+        for key, blob in items:
+            self._l1_put(key, blob, expires)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_forget([self.make_key(key, version=version)])
+        return super().add(key, value, timeout, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_forget([self.make_key(key, version=version)])
+        return super().touch(key, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        full_key = self.make_key(key, version=version)
+        self._l1_forget([full_key])
+        value = super().incr(key, delta, version)
+        self._l1_forget([full_key])
+        return value
+
+    def delete(self, key, version=None):
+        super().delete(key, version)
+        self._l1_forget([self.make_key(key, version=version)])
+
+    def delete_many(self, keys, version=None):
+        super().delete_many(keys, version)
+        self._l1_forget([self.make_key(key, version=version)
+                         for key in keys])
+
+    def clear(self):
+        super().clear()
+        with self._l1_lock:
+            self._l1.clear()
+            self._l1_bytes = 0
@@ -113,12 +113,97 @@ EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
-CACHES = {
-    "default": {
+# "shared" keeps one cache for all worker processes on the host in an SQLite
+# file, with a small per-process LRU tier in front of it. Pick the backend
+# with the YATUBE_CACHE environment variable.
+CACHE_BACKENDS = {
+    "local": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-    }
+    },
+    "shared": {
+        "BACKEND": "yatube.cache.TieredSQLiteCache",
+        "LOCATION": os.path.join(BASE_DIR, "cache.sqlite3"),
+        "OPTIONS": {
+            "MAX_ENTRIES": 100000,
+            "L1_MAX_BYTES": 16 * 2 ** 20,
+            "L1_TIMEOUT": 2,
+        },
+    },
+}
+
+CACHES = {
+    "default": CACHE_BACKENDS[os.environ.get("YATUBE_CACHE", "local")],
 }
 
+# Authors with more followers than this are not fanned out to follower
+# feeds on write; their posts are pulled and merged at read time instead.
+FEED_FANOUT_FOLLOWER_LIMIT = 10000
+
+# Pulled authors are pushed again by the sync_feed_fanout command once they
+# are back at or under this many followers; the gap keeps an author hovering
+# around the limit from flipping on every follow.
+FEED_FANOUT_RESUME_LIMIT = 9000
+
+# Feed sizes are counted exactly up to this many posts and shown as a
+# lower bound past it. Counts are cached until a post is added or removed.
+PAGINATOR_COUNT_LIMIT = 1000
+
+PAGINATOR_COUNT_TIMEOUT = 60 * 60 * 24
+
+# Comments shown on a post page, and loaded by every "Load more" click.
+COMMENTS_PER_PAGE = 20
+
+# Feed pages stay cached until a write bumps the generation of their scope.
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Rendered post cards are keyed by post version, which every edit, comment
+# and like bumps, so they only expire to free memory.
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Thumbnails rendered for every uploaded image.
+POST_CARD_THUMBNAIL = ("960x339", {"crop": "center", "upscale": True})
+
+THUMBNAIL_GEOMETRIES = [
+    POST_CARD_THUMBNAIL,
+]
+
+# The card image is also offered in WebP at these widths through srcset.
+POST_CARD_WIDTHS = [480, 960, 1440]
+
+POST_CARD_VARIANT_OPTIONS = {"format": "WEBP", "quality": 80}
+
+# Thumbnails are named after the content of their source image, so
+# the media server can send them with a far-future Cache-Control.
+THUMBNAIL_BACKEND = "posts.thumbnails.ContentAddressedBackend"
+
+# A thumbnail rendered twice at once keeps its name instead of being saved
+# again under a suffixed one.
+THUMBNAIL_STORAGE = "posts.storage.ContentAddressedStorage"
+
+# Thumbnails of a new upload are rendered by a pool of THUMBNAIL_WORKERS
+# processes; 0 renders them in the saving process.
+THUMBNAIL_WORKERS = 2
+
+# Uploaded images are checked from their header before being decoded and
+# stored re-encoded with at most IMAGE_MAX_SIDE pixels a side. The pixels
+# of all the frames of an animation count towards IMAGE_MAX_PIXELS.
+IMAGE_UPLOAD_MAX_BYTES = 10 * 2 ** 20
+
+IMAGE_MAX_PIXELS = 24 * 10 ** 6
+
+IMAGE_MAX_FRAMES = 100
+
+IMAGE_MAX_SIDE = 2048
+
+# Only one request rebuilds an expired page, card or count; the others get
+# the stale value, or wait up to CACHE_LOCK_WAIT seconds when there is none.
+CACHE_LOCK_TIMEOUT = 30
+
+CACHE_LOCK_WAIT = 2
+
+# Higher values refresh hot entries earlier before they expire.
+CACHE_EARLY_REFRESH_BETA = 1.0
+
 INTERNAL_IPS = [
     "127.0.0.1",
 ]